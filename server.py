@@ -1,101 +1,319 @@
 import asyncio
+import functools
+import hashlib
 import html
 import os
+import re
+import time
+from collections import OrderedDict
 from textwrap import dedent
-from typing import Optional
+from typing import Awaitable, Callable, Optional
 
 import anthropic
+import httpx
 from anthropic.types import Message
-import google.generativeai as genai
+from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
 from mcp.server.fastmcp import FastMCP
 
 mcp = FastMCP("DoubleCheck")
 
 GEMINI_MODEL_ID = os.getenv("DOUBLECHECK_GEMINI_MODEL", "models/gemini-3-pro-preview")
 SONNET_MODEL_ID = os.getenv("DOUBLECHECK_SONNET_MODEL", "claude-sonnet-4-5-20250929")
-CONTEXT_MAX_CHARS = 6000  # ~1500 tokens (4 chars/token) to keep prompts bounded
-PLAN_MAX_CHARS = 6000
-FILE_CONTEXT_MAX_CHARS = 12000  # Allow more room for the file under edit without blowing up the prompt
+SONNET_DEFAULT_MAX_TOKENS = int(os.getenv("DOUBLECHECK_SONNET_MAX_TOKENS", "600"))
+# Read once at import and validated when the server starts, not on every tool call.
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
+ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY", "")
+# Budgets are UTF-8 bytes so payload size and token counts stay bounded for non-Latin scripts too.
+CONTEXT_MAX_BYTES = 6000  # ~1500 tokens (4 bytes/token for ASCII) to keep prompts bounded
+PLAN_MAX_BYTES = 6000
+FILE_CONTEXT_MAX_BYTES = 12000  # Allow more room for the file under edit without blowing up the prompt
+# Shared pool sizing for both SDKs: HTTP/2 lets concurrent calls multiplex over one TLS session.
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=90)
+GEMINI_TIMEOUT_MS = 600_000  # Per-request deadline; google-genai takes milliseconds
+GEMINI_RETRY_ATTEMPTS = 3
+RESPONSE_CACHE_MAX_ENTRIES = 512
+# Upper bound on how long a caller waits for a shared in-flight API call (SDK retries included).
+INFLIGHT_TIMEOUT_SECONDS = float(os.getenv("DOUBLECHECK_CALL_TIMEOUT_SECONDS", "900"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("DOUBLECHECK_CACHE_TTL_SECONDS", "3600"))
+EMPTY_CLAUDE_RESPONSE = "Claude returned an empty response."
+# Fixed messages for the common SDK failures, so they never format (possibly large) exception text.
+GEMINI_RATE_LIMIT_MESSAGE = "Error calling Gemini (HTTP 429: rate limited, retry later)."
+CLAUDE_RATE_LIMIT_MESSAGE = "Error calling Claude: HTTP 429 (rate limited, retry later)"
+CLAUDE_CONNECTION_ERROR_MESSAGE = "Error calling Claude: could not reach the API (connection error or timeout)"
+GEMINI_MAX_CONCURRENCY = int(os.getenv("DOUBLECHECK_GEMINI_CONCURRENCY", "16"))
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("DOUBLECHECK_ANTHROPIC_CONCURRENCY", "8"))
+THROTTLE_BACKOFF_SECONDS = 30.0  # Hold a reduced concurrency cap this long after a 429/503/529 before growing it again
+THROTTLE_STATUS_CODES = (429, 503, 529)
+# Static Gemini preambles go out as system_instruction rather than being rebuilt into every prompt.
+GEMINI_PLAN_INSTRUCTION = "\n".join(
+    [
+        "Act as a Principal Staff Engineer.",
+        "Review the implementation plan for missing steps, incorrect assumptions, security risks, and edge cases.",
+        "Respond concisely with bullet points of issues/improvements and a final line: Verdict: [APPROVED] or Verdict: [CHANGES REQUESTED].",
+    ]
+)
+GEMINI_EDIT_PLAN_INSTRUCTION = "\n".join(
+    [
+        "Act as a Principal Staff Engineer.",
+        "Review this edit implementation plan for missing steps, incorrect assumptions, security risks, and edge cases.",
+        "The file under edit is provided below; consider it when reviewing the plan.",
+        "Respond concisely with bullet points of issues/improvements and a final line: Verdict: [APPROVED] or Verdict: [CHANGES REQUESTED].",
+    ]
+)
+# Fixed lines of the per-request Gemini prompt, built once so the formatters only add user text.
+_EXPECTATIONS_HEADER = "Specific concerns or constraints to keep in mind:"
+_PLAN_CONTEXT_HEADER = "Context (delimited to avoid mixing with instructions):"
+_EDIT_PLAN_CONTEXT_HEADER = "Additional context (delimited to avoid mixing with instructions):"
+_CONTEXT_OPEN = "<context>"
+_CONTEXT_CLOSE = "</context>"
+_CONTEXT_TRUNCATED_NOTE = f"(Context truncated to {CONTEXT_MAX_BYTES} bytes.)"
+_FILE_HEADER = "File under edit:"
+_FILE_CONTENT_OPEN = "<file_content>"
+_FILE_CONTENT_CLOSE = "</file_content>"
+_FILE_TRUNCATED_NOTE = f"(File content truncated to {FILE_CONTEXT_MAX_BYTES} bytes.)"
+_PLAN_HEADER = "Plan:"
+_PLAN_TRUNCATED_NOTE = f"(Plan truncated to {PLAN_MAX_BYTES} bytes.)"
+
+# Static system prompt carrying a prompt-cache breakpoint. At ~12 tokens it is far below Sonnet's
+# ~1024-token caching minimum, so the marker is inert (nothing is cached) until the static prefix
+# grows past that; keep anything per-request out of it so it can take effect then.
+SONNET_SYSTEM_BLOCKS = [
+    {
+        "type": "text",
+        "text": "You are an expert code reviewer. Be concise and specific.",
+        "cache_control": {"type": "ephemeral"},
+    }
+]
+
+_NON_SPACE = re.compile(r"\S")
+
+# (model, prompt) hash -> (stored_at, response text). Only touched from the event loop thread
+# with no awaits between lookup and store, so it needs no lock.
+_response_cache: OrderedDict[str, tuple[float, str]] = OrderedDict()
+# Same key -> the one API call currently producing that response, shared by identical concurrent requests.
+_inflight: dict[str, asyncio.Task] = {}
+# Shared task -> number of callers still awaiting it; the last one to leave cancels an unfinished task.
+_inflight_waiters: dict[asyncio.Task, int] = {}
 
 
 def _require_env(var: str) -> str:
     value = os.getenv(var)
     if not value:
-        raise RuntimeError(f"{var} is required for this tool but is not set.")
+        raise RuntimeError(f"{var} is required to start the DoubleCheck server but is not set.")
     return value
 
 
-def _build_gemini_model():
-    api_key = _require_env("GOOGLE_API_KEY")
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel(GEMINI_MODEL_ID)
+@functools.lru_cache(maxsize=1)
+def _build_gemini_client() -> genai.Client:
+    """
+    Build the Gemini client once so its HTTP/2 connection pool stays warm between plan checks.
+    """
+    http_options = genai_types.HttpOptions(
+        httpx_async_client=httpx.AsyncClient(http2=True, limits=HTTP_POOL_LIMITS),
+        # google-genai defaults to no timeout and a single attempt; restore the legacy SDK's
+        # 600s deadline and its retry of transient 503s.
+        timeout=GEMINI_TIMEOUT_MS,
+        retry_options=genai_types.HttpRetryOptions(attempts=GEMINI_RETRY_ATTEMPTS, http_status_codes=[503]),
+    )
+    return genai.Client(api_key=GOOGLE_API_KEY, http_options=http_options)
+
+
+@functools.lru_cache(maxsize=2)
+def _gemini_config(system_instruction: str) -> genai_types.GenerateContentConfig:
+    return genai_types.GenerateContentConfig(system_instruction=system_instruction)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_anthropic_client() -> anthropic.AsyncAnthropic:
+    """
+    Build the Anthropic client once so its connection pool stays warm between reviews.
+    """
+    http_client = anthropic.DefaultAsyncHttpxClient(http2=True, limits=HTTP_POOL_LIMITS)
+    return anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY, http_client=http_client)
+
+
+class _AdaptiveLimiter:
+    """
+    Async concurrency cap with AIMD backoff: the cap halves when the provider throttles us and,
+    once THROTTLE_BACKOFF_SECONDS pass without throttling, grows back by one slot per success.
+    """
+
+    def __init__(self, max_concurrency: int, is_throttle: Callable[[BaseException], bool]) -> None:
+        self._max = max(1, max_concurrency)
+        self._limit = self._max
+        self._active = 0
+        self._is_throttle = is_throttle
+        self._last_decrease = float("-inf")
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        async with self._cond:
+            self._active -= 1
+            now = time.monotonic()
+            if exc is not None and self._is_throttle(exc):
+                # A burst of concurrent 429s should cost one halving, not one per request.
+                if now - self._last_decrease > 1.0:
+                    self._limit = max(1, self._limit // 2)
+                    self._last_decrease = now
+            elif exc is None and self._limit < self._max and now - self._last_decrease >= THROTTLE_BACKOFF_SECONDS:
+                self._limit += 1
+            self._cond.notify_all()
+        return False
+
+
+def _is_gemini_throttle(exc: BaseException) -> bool:
+    return isinstance(exc, genai_errors.APIError) and exc.code in THROTTLE_STATUS_CODES
+
+
+def _is_anthropic_throttle(exc: BaseException) -> bool:
+    return isinstance(exc, anthropic.APIStatusError) and exc.status_code in THROTTLE_STATUS_CODES
+
 
+# Every model call is native async on the event loop (no asyncio.to_thread anywhere in this module),
+# so these caps, not the default worker-thread pool, are what bound in-flight API calls per provider.
+_GEMINI_LIMITER = _AdaptiveLimiter(GEMINI_MAX_CONCURRENCY, _is_gemini_throttle)
+_ANTHROPIC_LIMITER = _AdaptiveLimiter(ANTHROPIC_MAX_CONCURRENCY, _is_anthropic_throttle)
 
-def _build_anthropic_client() -> anthropic.Anthropic:
-    api_key = _require_env("ANTHROPIC_API_KEY")
-    return anthropic.Anthropic(api_key=api_key)
 
+def _cache_key(model_id: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{prompt}".encode("utf-8")).hexdigest()
 
-def _prepare_text(raw: str, max_chars: int) -> tuple[str, bool]:
+
+def _cache_get(key: str) -> Optional[str]:
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+    stored_at, text = entry
+    if time.monotonic() - stored_at > RESPONSE_CACHE_TTL_SECONDS:
+        del _response_cache[key]
+        return None
+    _response_cache.move_to_end(key)
+    return text
+
+
+def _cache_put(key: str, text: str) -> None:
+    if RESPONSE_CACHE_TTL_SECONDS <= 0:
+        return
+    _response_cache[key] = (time.monotonic(), text)
+    _response_cache.move_to_end(key)
+    while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+        _response_cache.popitem(last=False)
+
+
+def _finish_inflight(key: str, task: asyncio.Task) -> None:
+    _inflight.pop(key, None)
+    if task.cancelled() or task.exception() is not None:
+        return
+    text = task.result()
+    if text is not None:
+        _cache_put(key, text)
+
+
+async def _cached_generate(key: str, generate: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
     """
-    Normalize/truncate text without splitting multibyte characters. Returns (text, was_truncated).
+    Return a cached response, join an identical in-flight call, or start a new one.
+    `generate` returns None for empty/blocked responses, which are not cached.
+    """
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(generate())
+        _inflight[key] = task
+        task.add_done_callback(functools.partial(_finish_inflight, key))
+    _inflight_waiters[task] = _inflight_waiters.get(task, 0) + 1
+    try:
+        # Shielded so one caller leaving does not cancel the call other callers are waiting on;
+        # the timeout keeps a stalled call from holding every caller (and its key) forever.
+        return await asyncio.wait_for(asyncio.shield(task), INFLIGHT_TIMEOUT_SECONDS)
+    finally:
+        remaining = _inflight_waiters[task] - 1
+        if remaining:
+            _inflight_waiters[task] = remaining
+        else:
+            del _inflight_waiters[task]
+            if not task.done():
+                # Nobody is waiting any more: free the limiter slot and the _inflight key.
+                task.cancel()
+
+
+def _prepare_text(raw: str, max_bytes: int) -> tuple[str, bool]:
     """
-    cleaned = raw.strip()
-    if not cleaned:
+    Normalize/truncate text to a UTF-8 byte budget without splitting multibyte characters.
+    Returns (text, was_truncated).
+    """
+    if len(raw) * 4 <= max_bytes or (len(raw) <= max_bytes and raw.isascii()):
+        # Fits the budget whatever the encoding, so no need to encode.
+        return raw.strip(), False
+    # Oversized: find the first non-whitespace character and slice from there rather than
+    # stripping the whole input first.
+    first = _NON_SPACE.search(raw)
+    if first is None:
         return "", False
-    if len(cleaned) <= max_chars:
-        return cleaned, False
-    truncated = cleaned[:max_chars]
-    return truncated, True
+    start = first.start()
+    # Every character is at least one byte, so max_bytes characters always cover the budget.
+    head = raw[start : start + max_bytes]
+    encoded = head.encode("utf-8", errors="surrogatepass")
+    if len(encoded) > max_bytes:
+        # errors="ignore" drops a multibyte character cut in half at the boundary.
+        head = encoded[:max_bytes].decode("utf-8", errors="ignore")
+    end = start + len(head)
+    if _NON_SPACE.search(raw, end) is None:
+        # Only trailing whitespace lies past the budget.
+        return head.rstrip(), False
+    return head, True
 
 
 def _prepare_context(raw: str) -> tuple[str, bool]:
     """
-    Normalize/truncate context without splitting multibyte characters.
+    Normalize/truncate context to CONTEXT_MAX_BYTES without splitting multibyte characters.
     Returns (text, was_truncated).
     """
-    return _prepare_text(raw, CONTEXT_MAX_CHARS)
+    return _prepare_text(raw, CONTEXT_MAX_BYTES)
 
 
 def _prepare_file_text(raw: str) -> tuple[str, bool]:
     """
-    Normalize/truncate file content without splitting multibyte characters.
+    Normalize/truncate file content to FILE_CONTEXT_MAX_BYTES without splitting multibyte characters.
     Returns (text, was_truncated).
     """
-    return _prepare_text(raw, FILE_CONTEXT_MAX_CHARS)
+    return _prepare_text(raw, FILE_CONTEXT_MAX_BYTES)
 
 
 def _format_plan_prompt(
     plan_description: str, expectations: Optional[str], context: Optional[str]
 ) -> str:
-    trimmed_plan, plan_truncated = _prepare_text(plan_description, PLAN_MAX_CHARS)
+    trimmed_plan, plan_truncated = _prepare_text(plan_description, PLAN_MAX_BYTES)
 
-    sections: list[str] = [
-        "Act as a Principal Staff Engineer.",
-        "Review the implementation plan for missing steps, incorrect assumptions, security risks, and edge cases.",
-        "Respond concisely with bullet points of issues/improvements and a final line: Verdict: [APPROVED] or Verdict: [CHANGES REQUESTED].",
-        "",
-    ]
+    sections: list[str] = []
 
     if expectations and expectations.strip():
-        sections.append("Specific concerns or constraints to keep in mind:")
+        sections.append(_EXPECTATIONS_HEADER)
         sections.append(html.escape(expectations.strip()))
         sections.append("")
 
     if context and context.strip():
         prepared_context, context_truncated = _prepare_context(context)
-        sections.append("Context (delimited to avoid mixing with instructions):")
-        sections.append("<context>")
+        sections.append(_PLAN_CONTEXT_HEADER)
+        sections.append(_CONTEXT_OPEN)
         sections.append(html.escape(prepared_context))
-        sections.append("</context>")
+        sections.append(_CONTEXT_CLOSE)
         if context_truncated:
-            sections.append(f"(Context truncated to {CONTEXT_MAX_CHARS} characters.)")
+            sections.append(_CONTEXT_TRUNCATED_NOTE)
         sections.append("")
 
-    sections.append("Plan:")
+    sections.append(_PLAN_HEADER)
     sections.append(html.escape(trimmed_plan))
     if plan_truncated:
-        sections.append(f"(Plan truncated to {PLAN_MAX_CHARS} characters.)")
+        sections.append(_PLAN_TRUNCATED_NOTE)
 
     return "\n".join(sections).strip()
 
@@ -107,50 +325,66 @@ def _format_edit_plan_prompt(
     file_contents: str,
     context: Optional[str],
 ) -> str:
-    trimmed_plan, plan_truncated = _prepare_text(plan_description, PLAN_MAX_CHARS)
+    trimmed_plan, plan_truncated = _prepare_text(plan_description, PLAN_MAX_BYTES)
     trimmed_file, file_truncated = _prepare_file_text(file_contents)
 
-    sections: list[str] = [
-        "Act as a Principal Staff Engineer.",
-        "Review this edit implementation plan for missing steps, incorrect assumptions, security risks, and edge cases.",
-        "The file under edit is provided below; consider it when reviewing the plan.",
-        "Respond concisely with bullet points of issues/improvements and a final line: Verdict: [APPROVED] or Verdict: [CHANGES REQUESTED].",
-        "",
-    ]
+    sections: list[str] = []
 
     if expectations and expectations.strip():
-        sections.append("Specific concerns or constraints to keep in mind:")
+        sections.append(_EXPECTATIONS_HEADER)
         sections.append(html.escape(expectations.strip()))
         sections.append("")
 
     if context and context.strip():
         prepared_context, context_truncated = _prepare_context(context)
-        sections.append("Additional context (delimited to avoid mixing with instructions):")
-        sections.append("<context>")
+        sections.append(_EDIT_PLAN_CONTEXT_HEADER)
+        sections.append(_CONTEXT_OPEN)
         sections.append(html.escape(prepared_context))
-        sections.append("</context>")
+        sections.append(_CONTEXT_CLOSE)
         if context_truncated:
-            sections.append(f"(Context truncated to {CONTEXT_MAX_CHARS} characters.)")
+            sections.append(_CONTEXT_TRUNCATED_NOTE)
         sections.append("")
 
     file_label = file_path.strip() if file_path and file_path.strip() else "(unspecified file path)"
-    sections.append("File under edit:")
+    sections.append(_FILE_HEADER)
     sections.append(html.escape(file_label))
-    sections.append("<file_content>")
+    sections.append(_FILE_CONTENT_OPEN)
     sections.append(html.escape(trimmed_file))
-    sections.append("</file_content>")
+    sections.append(_FILE_CONTENT_CLOSE)
     if file_truncated:
-        sections.append(f"(File content truncated to {FILE_CONTEXT_MAX_CHARS} characters.)")
+        sections.append(_FILE_TRUNCATED_NOTE)
     sections.append("")
 
-    sections.append("Plan:")
+    sections.append(_PLAN_HEADER)
     sections.append(html.escape(trimmed_plan))
     if plan_truncated:
-        sections.append(f"(Plan truncated to {PLAN_MAX_CHARS} characters.)")
+        sections.append(_PLAN_TRUNCATED_NOTE)
 
     return "\n".join(sections).strip()
 
 
+async def _generate_gemini(system_instruction: str, prompt: str) -> Optional[str]:
+    client = _build_gemini_client()
+    parts: list[str] = []
+    async with _GEMINI_LIMITER:
+        stream = await client.aio.models.generate_content_stream(
+            model=GEMINI_MODEL_ID,
+            contents=prompt,
+            config=_gemini_config(system_instruction),
+        )
+        try:
+            async for chunk in stream:
+                text = chunk.text
+                if not text:
+                    continue
+                parts.append(text)
+        finally:
+            # Release the HTTP stream promptly, even if iteration fails part way through.
+            await stream.aclose()
+    text = "".join(parts)
+    return text if text.strip() else None
+
+
 @mcp.tool()
 async def gemini_plan_check(
     plan_description: str, expectations: Optional[str] = None, context: Optional[str] = None
@@ -162,12 +396,18 @@ async def gemini_plan_check(
         return "Error: plan_description is empty."
 
     try:
-        model = _build_gemini_model()
         prompt = _format_plan_prompt(plan_description, expectations, context)
-        response = await model.generate_content_async(prompt)
-        if response is None or not getattr(response, "text", None):
+        text = await _cached_generate(
+            _cache_key(GEMINI_MODEL_ID, f"{GEMINI_PLAN_INSTRUCTION}\0{prompt}"),
+            lambda: _generate_gemini(GEMINI_PLAN_INSTRUCTION, prompt),
+        )
+        if not text:
             return "Error: Gemini returned an empty or blocked response."
-        return response.text
+        return text
+    except genai_errors.APIError as exc:
+        if exc.code == 429:
+            return GEMINI_RATE_LIMIT_MESSAGE
+        return f"Error calling Gemini (HTTP {exc.code})."
     except Exception as exc:  # pylint: disable=broad-except
         return f"Error calling Gemini ({type(exc).__name__})."
 
@@ -189,28 +429,38 @@ async def gemini_edit_plan_check(
         return "Error: file_contents is empty."
 
     try:
-        model = _build_gemini_model()
         prompt = _format_edit_plan_prompt(plan_description, expectations, file_path, file_contents, context)
-        response = await model.generate_content_async(prompt)
-        if response is None or not getattr(response, "text", None):
+        text = await _cached_generate(
+            _cache_key(GEMINI_MODEL_ID, f"{GEMINI_EDIT_PLAN_INSTRUCTION}\0{prompt}"),
+            lambda: _generate_gemini(GEMINI_EDIT_PLAN_INSTRUCTION, prompt),
+        )
+        if not text:
             return "Error: Gemini returned an empty or blocked response."
-        return response.text
+        return text
+    except genai_errors.APIError as exc:
+        if exc.code == 429:
+            return GEMINI_RATE_LIMIT_MESSAGE
+        return f"Error calling Gemini (HTTP {exc.code})."
     except Exception as exc:  # pylint: disable=broad-except
         return f"Error calling Gemini ({type(exc).__name__})."
 
 
+# Dedented once at import; the snippet is substituted afterwards so its indentation cannot affect dedent.
+_SONNET_REVIEW_TEMPLATE = dedent(
+    """
+    Please review this code for correctness, safety, and maintainability.
+    Point out bugs, risky assumptions, insecure patterns, and unclear naming.
+
+    Code:
+    ```
+    {code}
+    ```
+    """
+).strip()
+
+
 def _build_sonnet_request(code_snippet: str, context: Optional[str]) -> list[dict]:
-    user_message = dedent(
-        f"""
-        Please review this code for correctness, safety, and maintainability.
-        Point out bugs, risky assumptions, insecure patterns, and unclear naming.
-
-        Code:
-        ```
-        {code_snippet}
-        ```
-        """
-    ).strip()
+    user_message = _SONNET_REVIEW_TEMPLATE.format(code=code_snippet)
 
     if context and context.strip():
         user_message = f"{user_message}\n\nAdditional context:\n{context.strip()}"
@@ -219,37 +469,92 @@ def _build_sonnet_request(code_snippet: str, context: Optional[str]) -> list[dic
 
 
 def _extract_anthropic_text(response: Message) -> str:
-    parts = []
-    for block in response.content:
-        text = getattr(block, "text", None)
-        if text:
-            parts.append(text)
-    return "\n".join(parts).strip() or "Claude returned an empty response."
+    texts = [text for text in (getattr(block, "text", None) for block in response.content) if text]
+    # Reviews almost always arrive as a single text block; skip the join for that case.
+    joined = texts[0] if len(texts) == 1 else "\n".join(texts)
+    return joined.strip() or EMPTY_CLAUDE_RESPONSE
+
+
+async def _generate_sonnet(model_id: str, max_tokens: int, messages: list[dict]) -> Optional[str]:
+    client = _build_anthropic_client()
+    async with _ANTHROPIC_LIMITER:
+        async with client.messages.stream(
+            model=model_id,
+            max_tokens=max_tokens,
+            system=SONNET_SYSTEM_BLOCKS,
+            messages=messages,
+        ) as stream:
+            response = await stream.get_final_message()
+    text = _extract_anthropic_text(response)
+    if text == EMPTY_CLAUDE_RESPONSE:
+        return None
+    if response.stop_reason == "max_tokens":
+        text = f"{text}\n\n(Review cut off at max_tokens={max_tokens}; call again with a higher max_tokens for the rest.)"
+    return text
 
 
 @mcp.tool()
-async def sonnet_code_review(code_snippet: str, context: Optional[str] = None) -> str:
+async def sonnet_code_review(
+    code_snippet: str,
+    context: Optional[str] = None,
+    max_tokens: int = SONNET_DEFAULT_MAX_TOKENS,
+    model: Optional[str] = None,
+) -> str:
     """
     Ask Claude Sonnet 4.5 to review code for bugs, security issues, and readability.
+    max_tokens caps the review length: the default keeps short reviews fast and cheap, since
+    generation time and output billing grow with it; raise it (e.g. 1800) for large diffs.
+    model overrides the Claude model for this call.
     """
     if not code_snippet.strip():
         return "Error: code_snippet is empty."
+    if max_tokens < 1:
+        return "Error: max_tokens must be a positive integer."
 
-    def _call_sonnet() -> Message:
-        client = _build_anthropic_client()
-        return client.messages.create(
-            model=SONNET_MODEL_ID,
-            max_tokens=1800,
-            system="You are an expert code reviewer. Be concise and specific.",
-            messages=_build_sonnet_request(code_snippet, context),
-        )
-
+    model_id = model.strip() if model and model.strip() else SONNET_MODEL_ID
     try:
-        response = await asyncio.to_thread(_call_sonnet)
-        return _extract_anthropic_text(response)
+        messages = _build_sonnet_request(code_snippet, context)
+        text = await _cached_generate(
+            _cache_key(f"{model_id}\0{max_tokens}", messages[0]["content"]),
+            lambda: _generate_sonnet(model_id, max_tokens, messages),
+        )
+        return text or EMPTY_CLAUDE_RESPONSE
+    except anthropic.RateLimitError:
+        return CLAUDE_RATE_LIMIT_MESSAGE
+    except anthropic.APIStatusError as exc:
+        return f"Error calling Claude: HTTP {exc.status_code}"
+    except (anthropic.APIConnectionError, TimeoutError):
+        return CLAUDE_CONNECTION_ERROR_MESSAGE
     except Exception as exc:  # pylint: disable=broad-except
         return f"Error calling Claude: {exc}"
 
 
+@mcp.tool()
+async def double_check(
+    plan_description: str,
+    code_snippet: str,
+    expectations: Optional[str] = None,
+    context: Optional[str] = None,
+    max_tokens: int = SONNET_DEFAULT_MAX_TOKENS,
+    model: Optional[str] = None,
+) -> str:
+    """
+    Run the Gemini plan check and the Claude code review concurrently and return both verdicts.
+    max_tokens and model are passed to sonnet_code_review; raise max_tokens for large diffs.
+    """
+    gemini_task = asyncio.create_task(gemini_plan_check(plan_description, expectations, context))
+    sonnet_task = asyncio.create_task(sonnet_code_review(code_snippet, context, max_tokens, model))
+    gemini_result, sonnet_result = await asyncio.gather(gemini_task, sonnet_task, return_exceptions=True)
+
+    if isinstance(gemini_result, BaseException):
+        gemini_result = f"Error calling Gemini ({type(gemini_result).__name__})."
+    if isinstance(sonnet_result, BaseException):
+        sonnet_result = f"Error calling Claude ({type(sonnet_result).__name__})."
+
+    return f"Gemini plan check:\n{gemini_result}\n\nClaude code review:\n{sonnet_result}"
+
+
 if __name__ == "__main__":
+    _require_env("GOOGLE_API_KEY")
+    _require_env("ANTHROPIC_API_KEY")
     mcp.run()
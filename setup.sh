@@ -69,8 +69,9 @@ install_deps() {
   RUN_ARGS=(
     "run"
     "--with" "mcp"
-    "--with" "google-generativeai"
+    "--with" "google-genai"
     "--with" "anthropic"
+    "--with" "httpx[http2]"
     "python"
     "$SERVER_PATH"
   )